@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, has_app_context
+from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event, func, insert, literal, select, union_all, update
 from datetime import datetime, date, timedelta
+import orjson
 import os
 
 app = Flask(__name__)
@@ -10,6 +13,11 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///leave_v2.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 15})
+
+def ojson(obj, status=200):
+    # orjson encodes date/datetime natively (same ISO format as .isoformat())
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
 
 # -------------------- Models --------------------
 class Employee(db.Model):
@@ -20,6 +28,8 @@ class Employee(db.Model):
     join_date = db.Column(db.Date, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
 
+    leave_requests = db.relationship('LeaveRequest', back_populates='employee')
+
 class LeaveType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(20), unique=True, nullable=False)
@@ -28,6 +38,8 @@ class LeaveType(db.Model):
     default_unit = db.Column(db.String(10), nullable=False)  # day | hour
     is_enabled = db.Column(db.Boolean, default=True)
 
+    leave_requests = db.relationship('LeaveRequest', back_populates='leave_type')
+
 class LeavePolicy(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(50), unique=True, nullable=False)
@@ -44,8 +56,14 @@ class LeaveRequest(db.Model):
     status = db.Column(db.String(20), default='PENDING')  # PENDING/APPROVED/REJECTED/CANCELLED
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    employee = db.relationship('Employee')
-    leave_type = db.relationship('LeaveType')
+    employee = db.relationship('Employee', back_populates='leave_requests')
+    leave_type = db.relationship('LeaveType', back_populates='leave_requests')
+
+    __table_args__ = (
+        db.Index('ix_lr_emp_status_created', 'employee_id', 'status', 'created_at'),
+        db.Index('ix_lr_status_start_end', 'status', 'start_dt', 'end_dt'),
+        db.Index('ix_lr_emp_status_start', 'employee_id', 'status', 'start_dt'),
+    )
 
 class ApprovalLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -64,15 +82,19 @@ DEFAULTS = {
     'admin_pin': '1234',
 }
 
+# policies change almost never; cached per process, refreshed on PUT /api/admin/policies
+_POLICY_CACHE: dict[str, str] = {}
+
 def get_policy(key: str) -> str:
+    if key in _POLICY_CACHE:
+        return _POLICY_CACHE[key]
     p = LeavePolicy.query.filter_by(key=key).first()
     if p:
+        _POLICY_CACHE[key] = p.value
         return p.value
-    # create default
+    # rows are seeded at startup (seed_defaults); never write from a read path
     v = DEFAULTS.get(key, '')
-    p = LeavePolicy(key=key, value=v)
-    db.session.add(p)
-    db.session.commit()
+    _POLICY_CACHE[key] = v
     return v
 
 # annual leave calculation (same as v1, but date-based)
@@ -95,6 +117,13 @@ def current_role():
 def current_employee_id():
     return session.get('employee_id')
 
+def current_employee():
+    # loaded at most once per request
+    if 'emp' not in g:
+        emp_id = current_employee_id()
+        g.emp = db.session.get(Employee, emp_id) if emp_id else None
+    return g.emp
+
 
 def require_employee():
     if current_role() != 'EMPLOYEE' or not current_employee_id():
@@ -120,7 +149,7 @@ def login():
         mode = request.form.get('mode')
         if mode == 'employee':
             emp_id = int(request.form.get('employee_id'))
-            emp = Employee.query.get(emp_id)
+            emp = db.session.get(Employee, emp_id)
             if not emp or not emp.is_active:
                 return render_template('login.html', error='직원을 찾을 수 없습니다.')
             session.clear()
@@ -178,14 +207,29 @@ def admin_settings():
 def api_me():
     role = current_role()
     if role == 'EMPLOYEE':
-        emp = Employee.query.get(current_employee_id())
-        return jsonify({'role': role, 'employee': {
+        emp = current_employee()
+        return ojson({'role': role, 'employee': {
             'id': emp.id, 'name': emp.name, 'department': emp.department, 'position': emp.position,
-            'join_date': emp.join_date.isoformat()
+            'join_date': emp.join_date
         }})
     if role == 'ADMIN':
-        return jsonify({'role': role})
-    return jsonify({'role': None})
+        return ojson({'role': role})
+    return ojson({'role': None})
+
+# hot-path statements built once; per-request values are bound parameters
+_USED_MINUTES_STMT = select(
+    LeaveType.code, func.coalesce(func.sum(LeaveRequest.requested_minutes), 0)
+).join(LeaveRequest, LeaveRequest.leave_type_id == LeaveType.id).where(
+    LeaveRequest.employee_id == bindparam('emp_id'),
+    LeaveRequest.status == 'APPROVED',
+    LeaveRequest.start_dt >= bindparam('start'),
+    LeaveRequest.start_dt <= bindparam('end'),
+).group_by(LeaveType.code)
+
+_STATUS_COUNTS_STMT = select(LeaveRequest.status, func.count(LeaveRequest.id)).where(
+    LeaveRequest.employee_id == bindparam('emp_id'),
+    LeaveRequest.status.in_(('PENDING', 'REJECTED')),
+).group_by(LeaveRequest.status)
 
 @app.route('/api/my/summary')
 def api_my_summary():
@@ -193,7 +237,7 @@ def api_my_summary():
         return jsonify({'error': 'unauthorized'}), 401
 
     year = int(request.args.get('year', date.today().year))
-    emp = Employee.query.get(current_employee_id())
+    emp = current_employee()
 
     workday_minutes = int(get_policy('workday_minutes') or '480')
 
@@ -205,36 +249,27 @@ def api_my_summary():
     start = datetime(year, 1, 1)
     end = datetime(year, 12, 31, 23, 59, 59)
 
-    approved = LeaveRequest.query.filter(
-        LeaveRequest.employee_id == emp.id,
-        LeaveRequest.status == 'APPROVED',
-        LeaveRequest.start_dt >= start,
-        LeaveRequest.start_dt <= end,
-    ).all()
+    used_rows = db.session.execute(_USED_MINUTES_STMT, {'emp_id': emp.id, 'start': start, 'end': end}).all()
 
     used_by_code = {'ANNUAL': 0, 'SICK': 0, 'EVENT': 0, 'PUBLIC': 0}
-    for r in approved:
-        used_by_code[r.leave_type.code] = used_by_code.get(r.leave_type.code, 0) + r.requested_minutes
-
-    def minutes_to_days(m):
-        return round(m / workday_minutes, 2)
+    used_by_code.update(dict(used_rows))
 
-    annual_used_days = minutes_to_days(used_by_code.get('ANNUAL', 0))
-    sick_used_days = minutes_to_days(used_by_code.get('SICK', 0))
-    event_used_days = minutes_to_days(used_by_code.get('EVENT', 0))
-    public_used_days = minutes_to_days(used_by_code.get('PUBLIC', 0))
+    used_days = {code: round(minutes / workday_minutes, 2) for code, minutes in used_by_code.items()}
+    annual_used_days = used_days['ANNUAL']
+    sick_used_days = used_days['SICK']
 
-    pending_count = LeaveRequest.query.filter_by(employee_id=emp.id, status='PENDING').count()
-    rejected_count = LeaveRequest.query.filter_by(employee_id=emp.id, status='REJECTED').count()
+    status_counts = dict(db.session.execute(_STATUS_COUNTS_STMT, {'emp_id': emp.id}).all())
+    pending_count = status_counts.get('PENDING', 0)
+    rejected_count = status_counts.get('REJECTED', 0)
 
-    return jsonify({
+    return ojson({
         'year': year,
         'workday_minutes': workday_minutes,
         'types': {
             'ANNUAL': {'granted_days': annual_granted_days, 'used_days': annual_used_days, 'remaining_days': round(annual_granted_days - annual_used_days, 2)},
             'SICK': {'granted_days': sick_granted_days, 'used_days': sick_used_days, 'remaining_days': round(sick_granted_days - sick_used_days, 2)},
-            'EVENT': {'used_days': event_used_days},
-            'PUBLIC': {'used_days': public_used_days},
+            'EVENT': {'used_days': used_days['EVENT']},
+            'PUBLIC': {'used_days': used_days['PUBLIC']},
         },
         'pending_count': pending_count,
         'rejected_count': rejected_count,
@@ -244,10 +279,25 @@ def api_my_summary():
 def api_leave_types():
     if current_role() not in ('EMPLOYEE', 'ADMIN'):
         return jsonify({'error': 'unauthorized'}), 401
+    return ojson(enabled_leave_types())
+
+# leave types are only seeded, never edited at runtime
+@cache.cached(timeout=60, key_prefix='enabled_leave_types')
+def enabled_leave_types():
     types = LeaveType.query.filter_by(is_enabled=True).order_by(LeaveType.id).all()
-    return jsonify([{
+    return [{
         'id': t.id, 'code': t.code, 'name_ko': t.name_ko, 'color_hex': t.color_hex, 'default_unit': t.default_unit
-    } for t in types])
+    } for t in types]
+
+# plain column tuples: no ORM instances (or lazy loads) for a read-only listing
+_MY_REQUESTS_STMT = select(
+    LeaveRequest.id, LeaveType.code, LeaveType.name_ko, LeaveType.color_hex,
+    LeaveRequest.start_dt, LeaveRequest.end_dt, LeaveRequest.requested_minutes,
+    LeaveRequest.reason, LeaveRequest.status, LeaveRequest.created_at,
+).join(LeaveType, LeaveType.id == LeaveRequest.leave_type_id).where(
+    LeaveRequest.employee_id == bindparam('emp_id')
+).order_by(LeaveRequest.created_at.desc()).limit(200)
+_MY_REQUESTS_BY_STATUS_STMT = _MY_REQUESTS_STMT.where(LeaveRequest.status == bindparam('status'))
 
 @app.route('/api/my/requests')
 def api_my_requests():
@@ -257,24 +307,23 @@ def api_my_requests():
     emp_id = current_employee_id()
     status = request.args.get('status')
 
-    q = LeaveRequest.query.filter_by(employee_id=emp_id)
     if status:
-        q = q.filter_by(status=status)
-    q = q.order_by(LeaveRequest.created_at.desc()).limit(200)
-    rows = q.all()
-
-    return jsonify([{
-        'id': r.id,
-        'type_code': r.leave_type.code,
-        'type_name': r.leave_type.name_ko,
-        'color': r.leave_type.color_hex,
-        'start_dt': r.start_dt.isoformat(),
-        'end_dt': r.end_dt.isoformat(),
-        'requested_minutes': r.requested_minutes,
-        'reason': r.reason,
-        'status': r.status,
-        'created_at': r.created_at.isoformat(),
-    } for r in rows])
+        q = db.session.execute(_MY_REQUESTS_BY_STATUS_STMT, {'emp_id': emp_id, 'status': status})
+    else:
+        q = db.session.execute(_MY_REQUESTS_STMT, {'emp_id': emp_id})
+
+    return ojson([{
+        'id': id_,
+        'type_code': type_code,
+        'type_name': type_name,
+        'color': color,
+        'start_dt': start_dt,
+        'end_dt': end_dt,
+        'requested_minutes': requested_minutes,
+        'reason': reason,
+        'status': status_,
+        'created_at': created_at,
+    } for (id_, type_code, type_name, color, start_dt, end_dt, requested_minutes, reason, status_, created_at) in q])
 
 @app.route('/api/my/requests', methods=['POST'])
 def api_create_request():
@@ -288,7 +337,7 @@ def api_create_request():
     requested_minutes = int(payload['requested_minutes'])
     reason = payload.get('reason')
 
-    lt = LeaveType.query.get(leave_type_id)
+    lt = db.session.get(LeaveType, leave_type_id)
     if not lt:
         return jsonify({'error': 'invalid leave type'}), 400
 
@@ -302,7 +351,7 @@ def api_create_request():
         status='PENDING'
     )
     db.session.add(r)
-    db.session.commit()
+    db.session.flush()  # assigns r.id; request and its log commit together
 
     db.session.add(ApprovalLog(leave_request_id=r.id, acted_by='EMPLOYEE', action='CREATE', comment=None))
     db.session.commit()
@@ -313,7 +362,7 @@ def api_create_request():
 def api_cancel_request(req_id):
     if not require_employee():
         return jsonify({'error': 'unauthorized'}), 401
-    r = LeaveRequest.query.get(req_id)
+    r = db.session.get(LeaveRequest, req_id)
     if not r or r.employee_id != current_employee_id():
         return jsonify({'error': 'not found'}), 404
     if r.status not in ('PENDING', 'APPROVED'):
@@ -329,61 +378,75 @@ def api_cancel_request(req_id):
 def api_admin_dashboard():
     if not require_admin():
         return jsonify({'error': 'unauthorized'}), 401
+    return ojson({**dashboard_counts(), 'admin_pin_hint': get_policy('admin_pin')})
 
+# polled by the dashboard page; a few seconds of staleness is fine for these counts
+@cache.cached(timeout=15, key_prefix='admin_dashboard_counts')
+def dashboard_counts():
     today = date.today()
     start = datetime(today.year, today.month, today.day)
     end = start + timedelta(days=1)
 
-    today_approved = LeaveRequest.query.filter(
-        LeaveRequest.status == 'APPROVED',
-        LeaveRequest.start_dt < end,
-        LeaveRequest.end_dt >= start,
-    ).count()
-
-    pending = LeaveRequest.query.filter_by(status='PENDING').count()
-
-    return jsonify({
-        'today_approved_count': today_approved,
-        'pending_count': pending,
-        'employee_count': Employee.query.filter_by(is_active=True).count(),
-        'admin_pin_hint': get_policy('admin_pin')
-    })
+    # one round-trip: (name, count) per counter
+    stmt = union_all(
+        select(literal('today_approved_count'), func.count(LeaveRequest.id)).where(
+            LeaveRequest.status == 'APPROVED',
+            LeaveRequest.start_dt < end,
+            LeaveRequest.end_dt >= start,
+        ),
+        select(literal('pending_count'), func.count(LeaveRequest.id)).where(LeaveRequest.status == 'PENDING'),
+        select(literal('employee_count'), func.count(Employee.id)).where(Employee.is_active == True),
+    )
+    return dict(db.session.execute(stmt).all())
+
+_INBOX_STMT = select(
+    LeaveRequest.id, Employee.name, Employee.department, Employee.position,
+    LeaveType.code, LeaveType.name_ko, LeaveType.color_hex,
+    LeaveRequest.start_dt, LeaveRequest.end_dt, LeaveRequest.requested_minutes,
+    LeaveRequest.reason, LeaveRequest.status, LeaveRequest.created_at,
+).join(Employee, Employee.id == LeaveRequest.employee_id).join(
+    LeaveType, LeaveType.id == LeaveRequest.leave_type_id
+).order_by(LeaveRequest.created_at.desc()).limit(300)
+_INBOX_BY_STATUS_STMT = _INBOX_STMT.where(LeaveRequest.status == bindparam('status'))
 
 @app.route('/api/admin/inbox')
 def api_admin_inbox():
     if not require_admin():
         return jsonify({'error': 'unauthorized'}), 401
     status = request.args.get('status', 'PENDING')
-    q = LeaveRequest.query
     if status:
-        q = q.filter_by(status=status)
-    q = q.order_by(LeaveRequest.created_at.desc()).limit(300)
-    rows = q.all()
-    return jsonify([{
-        'id': r.id,
-        'employee_name': r.employee.name,
-        'department': r.employee.department,
-        'position': r.employee.position,
-        'type_code': r.leave_type.code,
-        'type_name': r.leave_type.name_ko,
-        'color': r.leave_type.color_hex,
-        'start_dt': r.start_dt.isoformat(),
-        'end_dt': r.end_dt.isoformat(),
-        'requested_minutes': r.requested_minutes,
-        'reason': r.reason,
-        'status': r.status,
-        'created_at': r.created_at.isoformat(),
-    } for r in rows])
+        q = db.session.execute(_INBOX_BY_STATUS_STMT, {'status': status})
+    else:
+        q = db.session.execute(_INBOX_STMT)
+    return ojson([{
+        'id': id_,
+        'employee_name': employee_name,
+        'department': department,
+        'position': position,
+        'type_code': type_code,
+        'type_name': type_name,
+        'color': color,
+        'start_dt': start_dt,
+        'end_dt': end_dt,
+        'requested_minutes': requested_minutes,
+        'reason': reason,
+        'status': status_,
+        'created_at': created_at,
+    } for (id_, employee_name, department, position, type_code, type_name, color,
+           start_dt, end_dt, requested_minutes, reason, status_, created_at) in q])
 
 @app.route('/api/admin/requests/<int:req_id>/approve', methods=['POST'])
 def api_admin_approve(req_id):
     if not require_admin():
         return jsonify({'error': 'unauthorized'}), 401
-    r = LeaveRequest.query.get(req_id)
-    if not r or r.status != 'PENDING':
+    # conditional UPDATE: no prior SELECT, and two admins can't both act on the same request
+    res = db.session.execute(
+        update(LeaveRequest).where(LeaveRequest.id == req_id, LeaveRequest.status == 'PENDING')
+        .values(status='APPROVED').returning(LeaveRequest.id)
+    ).first()
+    if res is None:
         return jsonify({'error': 'not found or not pending'}), 404
-    r.status = 'APPROVED'
-    db.session.add(ApprovalLog(leave_request_id=r.id, acted_by='ADMIN', action='APPROVE', comment=None))
+    db.session.add(ApprovalLog(leave_request_id=req_id, acted_by='ADMIN', action='APPROVE', comment=None))
     db.session.commit()
     return jsonify({'success': True})
 
@@ -395,25 +458,52 @@ def api_admin_reject(req_id):
     comment = payload.get('comment')
     if not comment:
         return jsonify({'error': 'comment required'}), 400
-    r = LeaveRequest.query.get(req_id)
-    if not r or r.status != 'PENDING':
+    res = db.session.execute(
+        update(LeaveRequest).where(LeaveRequest.id == req_id, LeaveRequest.status == 'PENDING')
+        .values(status='REJECTED').returning(LeaveRequest.id)
+    ).first()
+    if res is None:
         return jsonify({'error': 'not found or not pending'}), 404
-    r.status = 'REJECTED'
-    db.session.add(ApprovalLog(leave_request_id=r.id, acted_by='ADMIN', action='REJECT', comment=comment))
+    db.session.add(ApprovalLog(leave_request_id=req_id, acted_by='ADMIN', action='REJECT', comment=comment))
     db.session.commit()
     return jsonify({'success': True})
 
+@app.route('/api/admin/requests/bulk_approve', methods=['POST'])
+def api_admin_bulk_approve():
+    if not require_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    payload = request.json or {}
+    raw = payload.get('ids')
+    # plain ints only: a string, dict or bool would otherwise iterate/coerce into real request ids
+    if not isinstance(raw, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in raw):
+        return jsonify({'error': 'invalid ids'}), 400
+    ids = list(dict.fromkeys(raw))
+    if not ids:
+        return jsonify({'error': 'ids required'}), 400
+    # one UPDATE + one executemany INSERT, single commit; only requests that were still PENDING get logged
+    approved_ids = db.session.execute(
+        update(LeaveRequest).where(LeaveRequest.id.in_(ids), LeaveRequest.status == 'PENDING')
+        .values(status='APPROVED').returning(LeaveRequest.id)
+    ).scalars().all()
+    if approved_ids:
+        db.session.execute(insert(ApprovalLog), [
+            {'leave_request_id': i, 'acted_by': 'ADMIN', 'action': 'APPROVE', 'comment': None}
+            for i in approved_ids
+        ])
+    db.session.commit()
+    return jsonify({'success': True, 'approved_ids': approved_ids})
+
 @app.route('/api/admin/employees')
 def api_admin_employees():
     if not require_admin():
         return jsonify({'error': 'unauthorized'}), 401
     rows = Employee.query.order_by(Employee.department, Employee.name).all()
-    return jsonify([{
+    return ojson([{
         'id': e.id,
         'name': e.name,
         'department': e.department,
         'position': e.position,
-        'join_date': e.join_date.isoformat(),
+        'join_date': e.join_date,
         'is_active': e.is_active
     } for e in rows])
 
@@ -439,7 +529,7 @@ def api_admin_policies():
         return jsonify({'error': 'unauthorized'}), 401
     if request.method == 'GET':
         keys = ['workday_minutes', 'sick_default_days', 'admin_pin']
-        return jsonify({k: get_policy(k) for k in keys})
+        return ojson({k: get_policy(k) for k in keys})
 
     p = request.json
     for k in ['workday_minutes', 'sick_default_days', 'admin_pin']:
@@ -451,15 +541,48 @@ def api_admin_policies():
             else:
                 row.value = str(p[k])
     db.session.commit()
+    _POLICY_CACHE.update({k: str(p[k]) for k in p if k in DEFAULTS})
     return jsonify({'success': True})
 
+# -------------------- Dev: query counting --------------------
+# debug only: warn when a single request issues more statements than this (N+1 regressions)
+QUERY_COUNT_WARN_THRESHOLD = 10
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def _reset_query_count():
+    g.query_count = 0
+
+def _warn_query_count(response):
+    n = g.get('query_count', 0)
+    if n > QUERY_COUNT_WARN_THRESHOLD:
+        app.logger.warning('%s %s issued %d SQL statements', request.method, request.path, n)
+    return response
+
+def install_query_counter():
+    if event.contains(db.engine, 'before_cursor_execute', _count_query):
+        return
+    event.listen(db.engine, 'before_cursor_execute', _count_query)
+    app.before_request(_reset_query_count)
+    app.after_request(_warn_query_count)
+
 # -------------------- Init data --------------------
 
+def set_sqlite_pragmas(dbapi_conn, _conn_record):
+    # WAL lets dashboard/summary readers proceed while an approval is being written
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.execute('PRAGMA cache_size=-20000')  # ~20MB
+    cur.close()
+
 def seed_defaults():
     # policies
-    for k, v in DEFAULTS.items():
-        if not LeavePolicy.query.filter_by(key=k).first():
-            db.session.add(LeavePolicy(key=k, value=v))
+    existing = {k for (k,) in db.session.query(LeavePolicy.key).filter(LeavePolicy.key.in_(DEFAULTS)).all()}
+    db.session.add_all(LeavePolicy(key=k, value=v) for k, v in DEFAULTS.items() if k not in existing)
     db.session.commit()
 
     # leave types
@@ -482,8 +605,15 @@ def seed_defaults():
         db.session.commit()
 
 with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
     db.create_all()
+    # create_all() skips indexes on tables that already exist
+    for ix in LeaveRequest.__table__.indexes:
+        ix.create(db.engine, checkfirst=True)
     seed_defaults()
+    # app.debug is only set here via FLASK_DEBUG; app.run(debug=True) below sets it after import
+    if app.debug or __name__ == '__main__':
+        install_query_counter()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)